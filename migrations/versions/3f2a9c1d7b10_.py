@@ -0,0 +1,84 @@
+"""change feed revisions and tombstones
+
+Revision ID: 3f2a9c1d7b10
+Revises: 04e0e666d724
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = '04e0e666d724'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_counter',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('revision', sa.BigInteger(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_tombstone_revision'), ['revision'], unique=False)
+
+    for table in ('character', 'planet', 'favorite'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('revision', sa.BigInteger(), nullable=False, server_default='0'))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # Give every existing row its own revision, one table after the other,
+    # so clients starting from cursor 0 receive the full current state.
+    op.execute('UPDATE "character" SET revision = id')
+    op.execute('UPDATE planet SET revision = id + (SELECT COALESCE(MAX(id), 0) FROM "character")')
+    op.execute('UPDATE favorite SET revision = id'
+               ' + (SELECT COALESCE(MAX(id), 0) FROM "character")'
+               ' + (SELECT COALESCE(MAX(id), 0) FROM planet)')
+    op.execute('INSERT INTO change_counter (id, value) VALUES (1,'
+               ' (SELECT COALESCE(MAX(id), 0) FROM "character")'
+               ' + (SELECT COALESCE(MAX(id), 0) FROM planet)'
+               ' + (SELECT COALESCE(MAX(id), 0) FROM favorite))')
+
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_character_revision'), ['revision'], unique=False)
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_planet_revision'), ['revision'], unique=False)
+
+    with op.batch_alter_table('favorite', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_user_id_revision', ['user_id', 'revision'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorite', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_user_id_revision')
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('revision')
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_planet_revision'))
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('revision')
+
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_character_revision'))
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('revision')
+
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tombstone_revision'))
+
+    op.drop_table('tombstone')
+    op.drop_table('change_counter')
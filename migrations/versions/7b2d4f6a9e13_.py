@@ -0,0 +1,28 @@
+"""job_lock table for per-kind job concurrency
+
+Revision ID: 7b2d4f6a9e13
+Revises: e3b6a1f90d42
+Create Date: 2026-10-20 10:14:37.902518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2d4f6a9e13'
+down_revision = 'e3b6a1f90d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_lock',
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('kind')
+    )
+
+
+def downgrade():
+    op.drop_table('job_lock')
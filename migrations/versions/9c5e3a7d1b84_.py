@@ -0,0 +1,30 @@
+"""pattern indexes for the admin prefix search
+
+Revision ID: 9c5e3a7d1b84
+Revises: 7b2d4f6a9e13
+Create Date: 2026-10-20 11:40:05.317842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c5e3a7d1b84'
+down_revision = '7b2d4f6a9e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # With a non-C collation Postgres can only use varchar_pattern_ops indexes
+    # for LIKE 'x%', the unique indexes on email and name do not help.
+    op.create_index('ix_user_email_pattern', 'user', ['email'], unique=False,
+                    postgresql_ops={'email': 'varchar_pattern_ops'})
+    op.create_index('ix_planet_name_pattern', 'planet', ['name'], unique=False,
+                    postgresql_ops={'name': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_planet_name_pattern', table_name='planet')
+    op.drop_index('ix_user_email_pattern', table_name='user')
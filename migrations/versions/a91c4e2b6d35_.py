@@ -0,0 +1,121 @@
+"""numeric shadow columns for character and planet stats
+
+Revision ID: a91c4e2b6d35
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-19 11:02:17.532906
+
+"""
+import math
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91c4e2b6d35'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+BIGINT_LIMIT = 2 ** 63
+
+# table -> {string column: numeric shadow column}
+SHADOW_COLUMNS = {
+    'character': {
+        'height': 'height_num',
+    },
+    'planet': {
+        'population': 'population_num',
+        'orbital_period': 'orbital_period_num',
+        'rotation_period': 'rotation_period_num',
+        'diameter': 'diameter_num',
+    },
+}
+
+
+def parse_number(value):
+    # kept in sync with utils.parse_number, migrations must not import the app
+    if value is None:
+        return None
+    try:
+        number = float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+    # "nan", "inf" and anything a BigInteger column cannot hold are not stats
+    if not math.isfinite(number) or abs(number) >= BIGINT_LIMIT:
+        return None
+    return number
+
+
+def backfill(table_name, columns):
+    # Walk the table by primary key in batches so big tables are never loaded
+    # at once and every UPDATE statement stays short.
+    bind = op.get_bind()
+    table = sa.table(table_name, sa.column('id'),
+                     *[sa.column(c) for c in columns],
+                     *[sa.column(c) for c in columns.values()])
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(table.c.id, *[table.c[c] for c in columns])
+            .where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            values = {'_id': row.id}
+            for source, target in columns.items():
+                number = parse_number(row._mapping[source])
+                if target == 'population_num' and number is not None:
+                    number = int(number)
+                values[target] = number
+            params.append(values)
+
+        bind.execute(
+            table.update().where(table.c.id == sa.bindparam('_id'))
+            .values({target: sa.bindparam(target) for target in columns.values()}),
+            params,
+        )
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('height_num', sa.Float(), nullable=True))
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('population_num', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('orbital_period_num', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('rotation_period_num', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('diameter_num', sa.Float(), nullable=True))
+
+    for table_name, columns in SHADOW_COLUMNS.items():
+        backfill(table_name, columns)
+
+    # indexes are built after the backfill, which is cheaper than maintaining them row by row
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_character_height_num'), ['height_num'], unique=False)
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_planet_population_num'), ['population_num'], unique=False)
+        batch_op.create_index(batch_op.f('ix_planet_orbital_period_num'), ['orbital_period_num'], unique=False)
+        batch_op.create_index(batch_op.f('ix_planet_rotation_period_num'), ['rotation_period_num'], unique=False)
+        batch_op.create_index(batch_op.f('ix_planet_diameter_num'), ['diameter_num'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_planet_diameter_num'))
+        batch_op.drop_index(batch_op.f('ix_planet_rotation_period_num'))
+        batch_op.drop_index(batch_op.f('ix_planet_orbital_period_num'))
+        batch_op.drop_index(batch_op.f('ix_planet_population_num'))
+        batch_op.drop_column('diameter_num')
+        batch_op.drop_column('rotation_period_num')
+        batch_op.drop_column('orbital_period_num')
+        batch_op.drop_column('population_num')
+
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_character_height_num'))
+        batch_op.drop_column('height_num')
@@ -0,0 +1,31 @@
+"""job_data table for import and export payloads
+
+Revision ID: b8f2c6d4e017
+Revises: 9c5e3a7d1b84
+Create Date: 2026-10-20 14:02:48.615239
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8f2c6d4e017'
+down_revision = '9c5e3a7d1b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_data',
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False),
+    sa.Column('lines', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['job_id'], ['job.id'], ),
+    sa.PrimaryKeyConstraint('job_id', 'seq')
+    )
+
+
+def downgrade():
+    op.drop_table('job_data')
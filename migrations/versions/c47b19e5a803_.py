@@ -0,0 +1,75 @@
+"""hash user passwords
+
+Revision ID: c47b19e5a803
+Revises: 5d8e07b4c2f1
+Create Date: 2026-10-19 16:48:03.275519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47b19e5a803'
+down_revision = '5d8e07b4c2f1'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+# A fixed method, so the result does not depend on the environment running the
+# migration. /token re-hashes with PASSWORD_HASH_METHOD on the next login.
+MIGRATION_HASH_METHOD = 'pbkdf2:sha256:600000'
+
+
+# 1cb8ecec7946 created this constraint without a name, so it got the default
+# name of the database (user_password_key on Postgres, none at all on SQLite).
+# The naming convention lets batch mode find the unnamed one on SQLite.
+NAMING_CONVENTION = {'uq': 'uq_%(table_name)s_%(column_0_name)s'}
+
+
+def password_unique_constraint():
+    for constraint in sa.inspect(op.get_bind()).get_unique_constraints('user'):
+        if constraint['column_names'] == ['password']:
+            return constraint['name'] or 'uq_user_password'
+    return None
+
+
+def upgrade():
+    # salted hashes are unique anyway, and the model no longer asks for it
+    constraint = password_unique_constraint()
+    if constraint is not None:
+        with op.batch_alter_table('user', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(constraint, type_='unique')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=80),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+    bind = op.get_bind()
+    user = sa.table('user', sa.column('id'), sa.column('password'))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(user.c.id, user.c.password)
+            .where(user.c.id > last_id).order_by(user.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            user.update().where(user.c.id == sa.bindparam('_id'))
+            .values(password=sa.bindparam('_password')),
+            [{'_id': row.id, '_password': generate_password_hash(row.password, method=MIGRATION_HASH_METHOD)}
+             for row in rows],
+        )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    # Hashes cannot be turned back into passwords and do not fit in 80
+    # characters, so the column keeps its length. Only the constraint returns.
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_unique_constraint('user_password_key', ['password'])
@@ -0,0 +1,26 @@
+"""pattern index for the admin character lookup
+
+Revision ID: d51a7e3c9f26
+Revises: b8f2c6d4e017
+Create Date: 2026-10-20 15:21:09.473861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd51a7e3c9f26'
+down_revision = 'b8f2c6d4e017'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the favorite form searches characters by name prefix, see ix_planet_name_pattern
+    op.create_index('ix_character_name_pattern', 'character', ['name'], unique=False,
+                    postgresql_ops={'name': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_character_name_pattern', table_name='character')
@@ -0,0 +1,26 @@
+"""index tombstones by entity and revision
+
+Revision ID: e3b6a1f90d42
+Revises: c47b19e5a803
+Create Date: 2026-10-19 18:31:22.604781
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b6a1f90d42'
+down_revision = 'c47b19e5a803'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.create_index('ix_tombstone_entity_revision', ['entity', 'revision'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.drop_index('ix_tombstone_entity_revision')
@@ -1,7 +1,206 @@
 import os
+from flask import request
 from flask_admin import Admin
 from models import db, User, Character, Planet, Favorite
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from flask_admin.model.ajax import DEFAULT_PAGE_SIZE
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.orm import joinedload, load_only
+from wtforms import PasswordField
+from wtforms.validators import ValidationError
+from passwords import hash_password
+from logs import audit
+from snapshot import request_refresh
+
+def prefix_pattern(term):
+    # LIKE pattern for "starts with term", used with escape='/'
+    return term.replace('/', '//').replace('%', '/%').replace('_', '/_') + '%'
+
+class PrefixAjaxModelLoader(QueryAjaxModelLoader):
+    """
+    Ajax lookup for form_ajax_refs with the same prefix search as the list
+    views, so every keystroke is an index range scan instead of flask-admin's
+    ILIKE '%term%' over the whole table. Only use indexed fields.
+    """
+    def get_list(self, term, offset=0, limit=DEFAULT_PAGE_SIZE):
+        query = self.get_query()
+        term = term.strip()
+        if term:
+            query = query.filter(or_(*[field.like(prefix_pattern(term), escape='/')
+                                       for field in self._cached_fields]))
+        if self.order_by:
+            query = query.order_by(self.order_by)
+        return query.offset(offset).limit(limit).all()
+
+class ScalableModelView(ModelView):
+    """
+    ModelView that stays fast on tables with millions of rows: estimated
+    counts, keyset paging on ?after=<id>, prefix search and column-limited
+    list queries. Only put indexed, non-null columns in column_sortable_list
+    and column_searchable_list.
+    """
+    list_template = 'admin/keyset_list.html'
+    simple_list_pager = True
+    can_set_page_size = False
+    page_size = 50
+    column_display_pk = True
+    column_default_sort = 'id'
+    column_sortable_list = ('id',)
+    # maintained by the models (change feed, numeric stat columns), never edited by hand
+    form_excluded_columns = ('revision', 'updated_at')
+
+    # below this many (estimated) rows an exact COUNT(*) is cheap enough
+    exact_count_threshold = 100000
+
+    def get_query(self):
+        columns = [getattr(self.model, x) for x in self.column_list if '.' not in x]
+        return super().get_query().options(load_only(*columns))
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        # page numbers are ignored, _apply_pagination seeks with ?after= instead
+        count, query = super().get_list(0, sort_column, sort_desc, search, filters,
+                                        execute=execute, page_size=page_size)
+        if not search and not filters:
+            count = self.estimated_count()
+        return count, query
+
+    def estimated_count(self):
+        table = self.model.__table__.name
+        dialect = self.session.get_bind().dialect.name
+        estimate = None
+        if dialect == 'postgresql':
+            estimate = self.session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"),
+                {"table": table},
+            ).scalar()
+        elif dialect == 'mysql':
+            estimate = self.session.execute(
+                text("SELECT table_rows FROM information_schema.tables"
+                     " WHERE table_schema = DATABASE() AND table_name = :table"),
+                {"table": table},
+            ).scalar()
+
+        if estimate is not None and estimate >= self.exact_count_threshold:
+            return estimate
+        return self.session.query(func.count('*')).select_from(self.model).scalar()
+
+    def after_model_change(self, form, model, is_created):
+        action = 'created' if is_created else 'updated'
+        audit(f'{model.__tablename__}_{action}', id=model.id, source='admin')
+        if isinstance(model, (Character, Planet)):
+            request_refresh()
+
+    def after_model_delete(self, model):
+        audit(f'{model.__tablename__}_deleted', id=model.id, source='admin')
+        if isinstance(model, (Character, Planet)):
+            request_refresh()
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # A constant prefix pattern can use a btree index, flask-admin's '%term%'
+        # cannot. On Postgres that needs the varchar_pattern_ops indexes on the
+        # searchable columns (see models.py) unless the database uses the C collation.
+        term = search.strip()
+        if term:
+            query = query.filter(or_(*[field.like(prefix_pattern(term), escape='/')
+                                       for field, path in self._search_fields]))
+        return query, count_query, joins, count_joins
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        # unknown or non-sortable columns fall back to the default order by id
+        if sort_column not in self._sortable_columns:
+            sort_column, sort_desc = None, False
+        query, joins = super()._apply_sorting(query, joins, sort_column, sort_desc)
+        # the primary key breaks ties so the keyset position is always unique
+        pk = getattr(self.model, self._primary_key)
+        if sort_column is not None and self._sortable_columns[sort_column].key != pk.key:
+            query = query.order_by(pk.desc() if sort_desc else pk)
+        return query, joins
+
+    def _apply_pagination(self, query, page, page_size):
+        after = request.args.get('after', type=int)
+        if after is not None:
+            query = query.filter(self._keyset_filter(after))
+        return super()._apply_pagination(query, 0, page_size)
+
+    def _keyset_filter(self, after):
+        pk = getattr(self.model, self._primary_key)
+        sort = self._get_column_by_idx(request.args.get('sort', type=int))
+        column = self._sortable_columns.get(sort[0]) if sort is not None else None
+        if column is None:
+            # same fallback as _apply_sorting: ascending by primary key
+            column, sort_desc = pk, False
+        else:
+            sort_desc = bool(request.args.get('desc', type=int))
+
+        if column.key == pk.key:
+            return pk < after if sort_desc else pk > after
+
+        last = select(column).where(pk == after).scalar_subquery()
+        if sort_desc:
+            return or_(column < last, and_(column == last, pk < after))
+        return or_(column > last, and_(column == last, pk > after))
+
+    def _get_list_extra_args(self):
+        # sorting or searching must start again from the first page
+        view_args = super()._get_list_extra_args()
+        view_args.extra_args.pop('after', None)
+        return view_args
+
+    def next_page_url(self, data):
+        args = request.args.to_dict()
+        args.pop('page', None)
+        args['after'] = self.get_pk_value(data[-1])
+        return self.get_url('.index_view', **args)
+
+    def first_page_url(self):
+        args = request.args.to_dict()
+        args.pop('page', None)
+        args.pop('after', None)
+        return self.get_url('.index_view', **args)
+
+class UserView(ScalableModelView):
+    column_list = ('id', 'email', 'is_active')
+    column_sortable_list = ('id', 'email')
+    column_searchable_list = ('email',)
+    # the stored hash is never shown, a new password gets hashed on save
+    form_excluded_columns = ScalableModelView.form_excluded_columns + ('password',)
+    form_extra_fields = {'new_password': PasswordField('New password')}
+
+    def on_model_change(self, form, model, is_created):
+        if form.new_password.data:
+            model.password = hash_password(form.new_password.data)
+        elif is_created:
+            raise ValidationError('A password is required')
+
+class CharacterView(ScalableModelView):
+    column_list = ('id', 'name', 'gender', 'birth_year', 'height')
+    form_excluded_columns = ScalableModelView.form_excluded_columns + tuple(Character.NUMERIC_FIELDS.values())
+
+class PlanetView(ScalableModelView):
+    column_list = ('id', 'name', 'climate', 'population', 'terrain')
+    column_sortable_list = ('id', 'name')
+    column_searchable_list = ('name',)
+    form_excluded_columns = ScalableModelView.form_excluded_columns + tuple(Planet.NUMERIC_FIELDS.values())
+
+class FavoriteView(ScalableModelView):
+    column_list = ('id', 'user.email', 'character.name', 'planet.name')
+    column_labels = {'user.email': 'User', 'character.name': 'Character', 'planet.name': 'Planet'}
+    # the edit form looks related rows up on demand instead of rendering every row in a select
+    form_ajax_refs = {
+        'user': PrefixAjaxModelLoader('user', db.session, User, fields=('email',)),
+        'character': PrefixAjaxModelLoader('character', db.session, Character, fields=('name',)),
+        'planet': PrefixAjaxModelLoader('planet', db.session, Planet, fields=('name',)),
+    }
+
+    def get_query(self):
+        # one LEFT JOIN per relation instead of a lazy load for every row shown
+        return super().get_query().options(
+            joinedload(Favorite.user).load_only(User.email),
+            joinedload(Favorite.character).load_only(Character.name),
+            joinedload(Favorite.planet).load_only(Planet.name),
+        )
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
@@ -10,10 +209,10 @@ def setup_admin(app):
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Character, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(Favorite, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CharacterView(Character, db.session))
+    admin.add_view(PlanetView(Planet, db.session))
+    admin.add_view(FavoriteView(Favorite, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
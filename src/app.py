@@ -2,13 +2,17 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
+from flask import Flask, request, jsonify, url_for, Response, stream_with_context
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import APIException, generate_sitemap, parse_number
 from admin import setup_admin
-from models import db, User, Character, Planet, Favorite
+from logs import setup_logging, audit
+from jobs import setup_jobs, submit_job
+from passwords import hash_password, verify_password
+from snapshot import setup_snapshot, snapshot_response, request_refresh
+from models import db, User, Character, Planet, Favorite, Tombstone, Job, JobData, TRACKED_MODELS
 
 from flask_jwt_extended import create_access_token, get_jwt_identity
 from flask_jwt_extended import jwt_required
@@ -33,12 +37,59 @@ MIGRATE = Migrate(app, db)
 db.init_app(app)
 CORS(app)
 setup_admin(app)
+setup_logging(app)
+setup_jobs(app)
+setup_snapshot(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+# Apply ?min_<field>=, ?max_<field>= and ?sort=<field>|-<field> to a listing.
+# Only the model's NUMERIC_FIELDS are allowed, and they all have an index,
+# so filtering and ordering happen in the database.
+def apply_numeric_filters(query, model):
+    for field, column_name in model.NUMERIC_FIELDS.items():
+        column = getattr(model, column_name)
+        for prefix, compare in (("min_", column.__ge__), ("max_", column.__le__)):
+            raw = request.args.get(prefix + field)
+            if raw is None:
+                continue
+            value = parse_number(raw)
+            if value is None:
+                raise APIException(f"{prefix}{field} must be a number", status_code=400)
+            query = query.filter(compare(value))
+
+    sort = request.args.get("sort")
+    if sort is None:
+        return query.order_by(model.id)
+
+    field = sort.lstrip("-")
+    if field not in model.NUMERIC_FIELDS:
+        raise APIException(f"Cannot sort by {field}", status_code=400)
+    column = getattr(model, model.NUMERIC_FIELDS[field])
+    if sort.startswith("-"):
+        return query.order_by(column.desc(), model.id.desc())
+    return query.order_by(column, model.id)
+
+# Set of ids the calling user has marked as favorite for one Favorite column
+# (character_id or planet_id), loaded with a single query on the user_id index.
+def favorite_ids(column):
+    rows = db.session.query(column).join(User, User.id == Favorite.user_id).filter(
+        User.email == get_jwt_identity(),
+        column.isnot(None),
+    )
+    return {x for (x,) in rows}
+
+# Serialize a listing, adding is_favorite to every row when ?with_favorites=1
+def serialize_listing(rows, column):
+    if request.args.get("with_favorites") not in ("1", "true"):
+        return [x.serialize() for x in rows]
+
+    favorites = favorite_ids(column)
+    return [dict(x.serialize(), is_favorite=x.id in favorites) for x in rows]
+
 # generate sitemap with all your endpoints
 @app.route('/')
 def sitemap():
@@ -50,10 +101,14 @@ def sitemap():
 def handle_token():
     email = request.json.get("email", None)
     password = request.json.get("password", None)
-    
-    new_token = User.query.filter_by(email=email, password=password).first()
-    if new_token is None:
+    if not isinstance(email, str) or not isinstance(password, str):
+        return jsonify({"msg": "Email and password must be strings"}), 400
+
+    user = User.query.filter_by(email=email).first()
+    if not verify_password(user, password):
         return jsonify({"msg": " This email or password is incorrect"}), 401
+    # verify_password may have upgraded the stored hash to the current cost
+    db.session.commit()
 
     access_token = create_access_token(identity=email)
     return jsonify(access_token=access_token)
@@ -65,10 +120,15 @@ def create_user():
     user_password = request.json.get("password", None)
 
     # Create a new User object and set its attributes
-    new_user = User(email=user_email, password=user_password)
-    print(new_user)
+    if not isinstance(user_email, str) or not isinstance(user_password, str):
+        return jsonify({"error": "Email and password must be strings"}), 400
+    if not user_email or not user_password:
+        return jsonify({"error": "Email and password are required"}), 400
+
+    new_user = User(email=user_email, password=hash_password(user_password))
     db.session.add(new_user)
     db.session.commit()
+    audit("user_created", user_id=new_user.id, email=new_user.email)
 
     return jsonify({"msg": "User created successfully"}), 201
 
@@ -94,13 +154,24 @@ def handle_favorites():
 @jwt_required()
 
 def handle_characters_all():
-    characters = Character.query.all()
-    return jsonify([x.serialize() for x in characters]), 200
+    cached = snapshot_response("character")
+    if cached is not None:
+        return cached
+
+    query = Character.query
+    if request.args.get("name") is not None:
+        query = query.filter_by(name=request.args["name"])
+    characters = apply_numeric_filters(query, Character).all()
+    return jsonify(serialize_listing(characters, Favorite.character_id)), 200
 
 # Get one specific Character
 @app.route('/characters/<int:character_id>', methods=['GET'])
 @jwt_required()
 def handle_characters(character_id):
+    cached = snapshot_response("character", character_id)
+    if cached is not None:
+        return cached
+
     characters = Character.query.filter_by(id=character_id).all()
     return jsonify([x.serialize() for x in characters]), 200
 
@@ -121,6 +192,7 @@ def create_characters(character_id):
         favorite = Favorite(user_id=user.id, character_id=character_id)
         db.session.add(favorite)
         db.session.commit()
+        audit("favorite_added", favorite_id=favorite.id, character_id=character_id)
 
         return jsonify({
             "msg": "Favorite added",
@@ -150,6 +222,7 @@ def delete_characters(character_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+    audit("favorite_removed", favorite_id=favorite.id, character_id=character_id)
     return jsonify({
         "msg": f"Favorite eliminated",
         "eliminated_id": f"{character_id}"
@@ -176,6 +249,8 @@ def update_characters(id):
  
     # Commit the changes to the database
     db.session.commit()
+    audit("character_updated", character_id=id)
+    request_refresh()
 
     return jsonify({
         "msg": f"character updated",
@@ -186,14 +261,23 @@ def update_characters(id):
 @app.route('/planets', methods=['GET'])
 @jwt_required()
 def handle_planets_all():
-   
-    planets = Planet.query.all()
-    return jsonify([x.serialize() for x in planets]), 200
+    cached = snapshot_response("planet")
+    if cached is not None:
+        return cached
+
+    query = Planet.query
+    if request.args.get("name") is not None:
+        query = query.filter_by(name=request.args["name"])
+    planets = apply_numeric_filters(query, Planet).all()
+    return jsonify(serialize_listing(planets, Favorite.planet_id)), 200
 
 # Get one specific Planet
 @app.route('/planets/<int:planet_id>', methods=['GET'])
 @jwt_required()
 def handle_planets(planet_id):
+        cached = snapshot_response("planet", planet_id)
+        if cached is not None:
+            return cached
 
         planets = Planet.query.filter_by(id=planet_id).all()
         return jsonify([x.serialize() for x in planets]), 200
@@ -215,6 +299,7 @@ def create_planets(planet_id):
         favorite = Favorite(user_id=user.id, planet_id=planet_id)
         db.session.add(favorite)
         db.session.commit()
+        audit("favorite_added", favorite_id=favorite.id, planet_id=planet_id)
 
         return jsonify({
             "msg": "Favorite added",
@@ -243,6 +328,7 @@ def delete_planets(planet_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+    audit("favorite_removed", favorite_id=favorite.id, planet_id=planet_id)
     return jsonify({
         "msg": f"Favorite eliminated",
         "eliminated_id": f"{planet_id}"
@@ -270,12 +356,96 @@ def update_planets(id):
  
     # Commit the changes to the database
     db.session.commit()
+    audit("planet_updated", planet_id=id)
+    request_refresh()
 
     return jsonify({
         "msg": f"Planet updated",
         "updated_id": id
     }), 200
 
+# Get everything that changed after a given cursor, so clients can sync incrementally.
+# Start with since=0 and keep passing back the returned cursor while has_more is true.
+@app.route('/changes', methods=['GET'])
+@jwt_required()
+def handle_changes():
+    since = request.args.get("since", 0, type=int)
+    limit = min(max(request.args.get("limit", 500, type=int), 1), 1000)
+
+    user = User.query.filter_by(email=get_jwt_identity()).first()
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+
+    # Every table is read through its revision index, at most limit + 1 rows each,
+    # so the cost depends on how much changed and not on the size of the tables.
+    changes = []
+    for entity, model in TRACKED_MODELS.items():
+        query = model.query.filter(model.revision > since)
+        if model is Favorite:
+            query = query.filter_by(user_id=user.id)
+        for row in query.order_by(model.revision).limit(limit + 1):
+            changes.append({
+                "entity": entity,
+                "op": "upsert",
+                "revision": row.revision,
+                "data": row.serialize(),
+            })
+
+    tombstones = Tombstone.query.filter(
+        Tombstone.revision > since,
+        db.or_(Tombstone.user_id.is_(None), Tombstone.user_id == user.id),
+    ).order_by(Tombstone.revision).limit(limit + 1)
+    changes += [x.serialize() for x in tombstones]
+
+    changes.sort(key=lambda x: x["revision"])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    return jsonify({
+        "cursor": changes[-1]["revision"] if changes else since,
+        "has_more": has_more,
+        "changes": changes,
+    }), 200
+
+# Queue a background job, run by `flask jobs worker`
+# Body: {"kind": "export" | "import" | "reparse_stats", "params": {...}}
+# An import takes its rows in the body ("rows": [{...}, ...]) or reads a
+# finished export of yours ("params": {"table": ..., "source": <job id>})
+@app.route('/jobs', methods=['POST'])
+@jwt_required()
+def create_job():
+    job = submit_job(request.json.get("kind"), request.json.get("params", {}), get_jwt_identity(),
+                     rows=request.json.get("rows"))
+    audit("job_submitted", job_id=job.id, kind=job.kind)
+    return jsonify(job.serialize()), 202
+
+# Poll the status and progress of one of your jobs
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def handle_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_email=get_jwt_identity()).first()
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.serialize()), 200
+
+# Download the rows of one of your finished exports as JSON lines
+@app.route('/jobs/<int:job_id>/data', methods=['GET'])
+@jwt_required()
+def handle_job_data(job_id):
+    job = Job.query.filter_by(id=job_id, user_email=get_jwt_identity()).first()
+    if job is None or job.kind != "export":
+        return jsonify({"error": "Export not found"}), 404
+    if job.status != "done":
+        return jsonify({"error": "Export is not finished"}), 409
+
+    seqs = db.session.query(JobData.seq).filter_by(job_id=job_id).order_by(JobData.seq).all()
+
+    def generate():
+        # one chunk in memory at a time
+        for (seq,) in seqs:
+            yield db.session.get(JobData, (job_id, seq)).lines
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
@@ -0,0 +1,63 @@
+"""
+Compare database-backed reads with snapshot mode for the reference data.
+Creates a throwaway SQLite database, so it can run anywhere:
+
+    $ python src/bench_snapshot.py --characters 2000 --planets 500 --requests 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--characters", type=int, default=2000)
+    parser.add_argument("--planets", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    # configure the app before it is imported
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_file
+    os.environ.setdefault("JWT_SECRET", "benchmark secret key of at least 32 bytes")
+    os.environ.setdefault("LOG_FILE", os.devnull)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from flask_jwt_extended import create_access_token
+    from app import app
+    from models import db, Character, Planet
+    import snapshot
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(Character(name=f"Character {i}", height=str(100 + i % 150), gender="n/a")
+                           for i in range(args.characters))
+        db.session.add_all(Planet(name=f"Planet {i}", population=str(i * 1000), diameter=str(i % 999))
+                           for i in range(args.planets))
+        db.session.commit()
+        token = create_access_token(identity="benchmark")
+
+    client = app.test_client()
+    headers = {"Authorization": "Bearer " + token}
+    urls = ["/characters", "/planets", "/characters/1", "/planets/1", "/planets?name=Planet%201"]
+
+    def run(label):
+        print(label)
+        for url in urls:
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                response = client.get(url, headers=headers)
+            elapsed = (time.perf_counter() - start) / args.requests
+            print(f"  {url:28} {elapsed * 1000:8.3f} ms/request  {len(response.data):>9} bytes")
+
+    snapshot.current = None
+    run("database")
+
+    start = time.perf_counter()
+    snapshot.refresh(app)
+    print(f"snapshot built in {(time.perf_counter() - start) * 1000:.1f} ms")
+    run("snapshot")
+
+if __name__ == "__main__":
+    main()
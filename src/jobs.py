@@ -0,0 +1,307 @@
+"""
+Background jobs for bulk operations that are too slow for a web request.
+Jobs are rows in the job table, so no broker is needed: POST /jobs queues
+one and `flask jobs worker` runs a pool of processes that claim and run them.
+Every job is processed in chunks and its cursor is saved after each chunk,
+so a job interrupted by a crash or a restart resumes where it stopped.
+"""
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from models import db, Job, JobData, JobLock, TRACKED_MODELS
+from utils import APIException
+
+CHUNK_SIZE = int(os.environ.get("JOB_CHUNK_SIZE", 500))
+# a running job without a heartbeat for this long is considered abandoned
+STALE_AFTER = timedelta(seconds=int(os.environ.get("JOB_STALE_SECONDS", 300)))
+POLL_INTERVAL = 2
+
+def table_param(params):
+    table = params.get("table")
+    if table not in ("character", "planet"):
+        raise APIException("table must be character or planet", status_code=400)
+    return TRACKED_MODELS[table]
+
+def count_rows(job):
+    return table_param(job.params).query.count()
+
+def save_rows(job_id, rows):
+    # uploaded rows are stored as JobData chunks, the same way an export writes them
+    for seq, start in enumerate(range(0, len(rows), CHUNK_SIZE)):
+        chunk = rows[start:start + CHUNK_SIZE]
+        db.session.add(JobData(job_id=job_id, seq=seq, row_count=len(chunk),
+                               lines="".join(json.dumps(x) + "\n" for x in chunk)))
+
+# Every step function processes one chunk of a job and returns
+# (new_cursor, processed). new_cursor is None once the job is done.
+
+# Export a table as JSON lines, downloaded from GET /jobs/<id>/data
+def export_table(job, cursor):
+    model = table_param(job.params)
+    cursor = cursor or {"after": 0, "seq": 0}
+    rows = model.query.filter(model.id > cursor["after"]).order_by(model.id).limit(CHUNK_SIZE).all()
+    if not rows:
+        job.result = {"rows": job.progress, "download": f"/jobs/{job.id}/data"}
+        return None, 0
+
+    # committed together with the new cursor, so a resumed job never writes a chunk twice
+    db.session.add(JobData(job_id=job.id, seq=cursor["seq"], row_count=len(rows),
+                           lines="".join(json.dumps(x.serialize()) + "\n" for x in rows)))
+    return {"after": rows[-1].id, "seq": cursor["seq"] + 1}, len(rows)
+
+def import_source(job):
+    """
+    The job whose JobData an import reads: the import itself when the rows were
+    uploaded with it, or a finished export of the same table by the same user.
+    Checked by the worker, so a bad source fails the job.
+    """
+    source = db.session.get(Job, job.params.get("source") or 0)
+    if source is not None and source.id == job.id:
+        return source
+    if (source is None or source.user_email != job.user_email or source.kind != "export"
+            or source.status != "done" or source.params.get("table") != job.params.get("table")):
+        raise APIException("source must be one of your finished exports of the same table")
+    return source
+
+# Re-import characters or planets from uploaded rows or an export, by id
+def import_table(job, cursor):
+    model = table_param(job.params)
+    # only what an export contains: the shadow, revision and timestamp columns are
+    # maintained by the model and an explicit value would overwrite them
+    fields = set(model().serialize())
+    seq = cursor or 0
+
+    chunk = db.session.get(JobData, (import_source(job).id, seq))
+    if chunk is None:
+        reset_id_sequence(model)
+        return None, 0
+    for line in chunk.lines.splitlines():
+        if line.strip():
+            row = json.loads(line)
+            db.session.merge(model(**{k: v for k, v in row.items() if k in fields}))
+    return seq + 1, chunk.row_count
+
+def reset_id_sequence(model):
+    # rows inserted with explicit ids do not advance the Postgres sequence,
+    # the next insert without an id would reuse one of them
+    if db.session.get_bind().dialect.name != "postgresql":
+        return
+    table = db.session.get_bind().dialect.identifier_preparer.format_table(model.__table__)
+    db.session.execute(
+        text("SELECT setval(pg_get_serial_sequence(:table, 'id'), coalesce(max(id), 0) + 1, false)"
+             f" FROM {table}"),
+        {"table": table},
+    )
+
+def validate_import(params):
+    table_param(params)
+    if "source" in params and not isinstance(params["source"], int):
+        raise APIException("source must be the id of an export job", status_code=400)
+
+def count_import(job):
+    source = import_source(job)
+    return db.session.query(db.func.sum(JobData.row_count)).filter(JobData.job_id == source.id).scalar() or 0
+
+# Recompute the numeric stat columns of a table, e.g. after changing parse_number
+def reparse_stats(job, cursor):
+    model = table_param(job.params)
+    after = cursor or 0
+    rows = model.query.filter(model.id > after).order_by(model.id).limit(CHUNK_SIZE).all()
+    for row in rows:
+        # assigning the string fields again runs the model validators
+        for field in model.NUMERIC_FIELDS:
+            setattr(row, field, getattr(row, field))
+    if not rows:
+        return None, 0
+    return rows[-1].id, len(rows)
+
+# Registered job kinds, max_concurrent is enforced across all worker processes.
+# Only kinds with takes_rows accept rows uploaded with POST /jobs.
+JOB_KINDS = {
+    "export": {"step": export_table, "count": count_rows, "validate": table_param, "max_concurrent": 2},
+    "import": {"step": import_table, "count": count_import, "validate": validate_import, "max_concurrent": 1,
+               "takes_rows": True},
+    "reparse_stats": {"step": reparse_stats, "count": count_rows, "validate": table_param, "max_concurrent": 1},
+}
+
+def submit_job(kind, params, user_email, rows=None):
+    if kind not in JOB_KINDS:
+        raise APIException(f"Unknown job kind {kind}", status_code=400)
+    if not isinstance(params, dict):
+        raise APIException("params must be an object", status_code=400)
+    if rows is not None:
+        if not JOB_KINDS[kind].get("takes_rows"):
+            raise APIException(f"{kind} jobs do not take rows", status_code=400)
+        if not isinstance(rows, list) or not all(isinstance(x, dict) for x in rows):
+            raise APIException("rows must be a list of objects", status_code=400)
+
+    JOB_KINDS[kind]["validate"](params)
+    job = Job(kind=kind, params=params, user_email=user_email, status="queued")
+    db.session.add(job)
+    if rows is not None:
+        db.session.flush()
+        job.params = dict(params, source=job.id)
+        save_rows(job.id, rows)
+    db.session.commit()
+    return job
+
+def requeue_stale_jobs():
+    Job.query.filter(
+        Job.status == "running",
+        Job.heartbeat_at < datetime.utcnow() - STALE_AFTER,
+    ).update({"status": "queued", "worker": None})
+    db.session.commit()
+
+def lock_kind(kind):
+    """
+    Hold the job_lock row of a job kind until the next commit. The UPDATE takes
+    a row lock (the write lock on SQLite), so workers claiming the same kind
+    run their count-and-claim one after the other.
+    """
+    if JobLock.query.filter_by(kind=kind).update({"locked_at": datetime.utcnow()}):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(JobLock(kind=kind, locked_at=datetime.utcnow()))
+    except IntegrityError:
+        # another worker created the row first, wait for its lock instead
+        JobLock.query.filter_by(kind=kind).update({"locked_at": datetime.utcnow()})
+
+def claim_job(worker):
+    """
+    Take the oldest queued job whose kind is below its concurrency limit.
+    Counting the running jobs and claiming one happen under the kind's lock
+    row, so max_concurrent holds across all worker processes.
+    """
+    requeue_stale_jobs()
+    candidates = Job.query.with_entities(Job.id, Job.kind).filter(
+        Job.status == "queued").order_by(Job.id).limit(50).all()
+    db.session.commit()
+
+    full = set()
+    for job_id, kind in candidates:
+        if kind not in JOB_KINDS or kind in full:
+            continue
+
+        lock_kind(kind)
+        running = Job.query.filter_by(status="running", kind=kind).count()
+        if running >= JOB_KINDS[kind]["max_concurrent"]:
+            db.session.commit()
+            full.add(kind)
+            continue
+
+        claimed = Job.query.filter(Job.id == job_id, Job.status == "queued").update(
+            {"status": "running", "worker": worker, "heartbeat_at": datetime.utcnow()})
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+def run_job(job, stop):
+    kind = JOB_KINDS[job.kind]
+    try:
+        if job.started_at is None:
+            job.started_at = datetime.utcnow()
+            job.total = kind["count"](job)
+            db.session.commit()
+
+        cursor = job.cursor
+        while not stop.is_set():
+            cursor, processed = kind["step"](job, cursor)
+            job.cursor = cursor
+            job.progress += processed
+            job.heartbeat_at = datetime.utcnow()
+            if cursor is None:
+                job.status = "done"
+                job.finished_at = datetime.utcnow()
+            db.session.commit()
+            if cursor is None:
+                return
+
+        # shutting down: hand the job back, it resumes from the saved cursor
+        job.status = "queued"
+        job.worker = None
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job.status = "failed"
+        # APIException keeps its text in .message, str() of it is empty
+        job.error = getattr(e, "message", None) or str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+class WorkerStop:
+    """
+    The pool's stop event plus a SIGTERM flag of this process. The signal
+    handler only flips the flag: setting the shared Event from a handler can
+    deadlock when the interrupted code is waiting on that same Event.
+    """
+    def __init__(self, stop):
+        self.stop = stop
+        self.terminated = False
+        signal.signal(signal.SIGTERM, self.terminate)
+
+    def terminate(self, *args):
+        self.terminated = True
+
+    def is_set(self):
+        return self.terminated or self.stop.is_set()
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.is_set() and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+def work(app, stop, number):
+    # the parent handles Ctrl+C and tells the pool to stop through `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # platforms send SIGTERM to every process on shutdown: finish the current
+    # chunk and hand the job back instead of dying in the middle of it
+    stop = WorkerStop(stop)
+    worker = f"{socket.gethostname()}:{os.getpid()}:{number}"
+    with app.app_context():
+        # connections inherited from the parent process must not be shared
+        db.engine.dispose(close=False)
+        while not stop.is_set():
+            job = claim_job(worker)
+            if job is None:
+                stop.wait(POLL_INTERVAL)
+                continue
+            run_job(job, stop)
+        db.session.remove()
+
+jobs_cli = AppGroup("jobs", help="Run and inspect background jobs.")
+
+@jobs_cli.command("worker")
+@click.option("--processes", default=2, show_default=True, help="Number of worker processes.")
+def worker_command(processes):
+    """Run a pool of job worker processes until interrupted."""
+    from flask import current_app
+    app = current_app._get_current_object()
+
+    context = multiprocessing.get_context("fork")
+    stop = context.Event()
+    pool = [context.Process(target=work, args=(app, stop, n)) for n in range(processes)]
+    for process in pool:
+        process.start()
+
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    click.echo(f"Started {processes} job workers")
+    try:
+        for process in pool:
+            process.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for process in pool:
+            process.join()
+
+def setup_jobs(app):
+    app.cli.add_command(jobs_cli)
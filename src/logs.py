@@ -0,0 +1,128 @@
+"""
+Structured (JSON lines) access and audit logging that never blocks a request.
+Records go into a bounded in-memory queue and a background thread writes them
+to LOG_FILE (or stdout) in batches. When the queue is full new records are
+dropped and counted, and the count is written to the log as soon as possible.
+"""
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from flask import request, g
+from flask_jwt_extended import get_jwt_identity
+
+class AsyncJSONLogger:
+    def __init__(self, path=None, max_queue=10000, batch_size=500, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="json-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, record):
+        record.setdefault("ts", datetime.now(timezone.utc).isoformat())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def close(self, timeout=5):
+        # called on worker shutdown, whatever is still queued gets written
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _take_dropped(self):
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        dropped = self._take_dropped()
+        if dropped:
+            batch.append({
+                "ts": datetime.now(timezone.utc).isoformat(),
+                "type": "log_dropped",
+                "count": dropped,
+            })
+        return batch
+
+    def _write(self, batch):
+        # one write per batch, so lines from several workers do not interleave
+        data = "".join(json.dumps(x, default=str) + "\n" for x in batch)
+        try:
+            if self.path is None:
+                sys.stdout.write(data)
+                sys.stdout.flush()
+            else:
+                with open(self.path, "a") as f:
+                    f.write(data)
+        except OSError:
+            with self._lock:
+                self.dropped += len(batch)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            elif self._stopped.is_set():
+                return
+
+logger = None
+
+def current_user():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        # the route is not protected with @jwt_required()
+        return None
+
+def audit(event, **fields):
+    if logger is None:
+        return
+    logger.log(dict({"type": "audit", "event": event, "user": current_user()}, **fields))
+
+def setup_logging(app):
+    global logger
+    logger = AsyncJSONLogger(
+        path=os.environ.get("LOG_FILE"),
+        max_queue=int(os.environ.get("LOG_QUEUE_SIZE", 10000)),
+    )
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_access(response):
+        started = g.get("request_started", time.perf_counter())
+        logger.log({
+            "type": "access",
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "remote_addr": request.remote_addr,
+            "user": current_user(),
+        })
+        return response
@@ -1,4 +1,8 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session, validates
+from utils import parse_number
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
@@ -8,9 +12,14 @@ db = SQLAlchemy()
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=True, nullable=False)
+    # werkzeug hash string, see passwords.py
+    password = db.Column(db.String(255), nullable=False)
     is_active = db.Column(db.Boolean())
 
+    # lets the admin prefix search (LIKE 'x%') use an index on Postgres
+    __table_args__ = (db.Index('ix_user_email_pattern', 'email',
+                               postgresql_ops={'email': 'varchar_pattern_ops'}),)
+
     def __repr__(self):
         return '<User %r>' % self.email
 
@@ -27,6 +36,14 @@ class Favorite(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     character_id= db.Column(db.Integer, db.ForeignKey("character.id"))
     planet_id= db.Column(db.Integer, db.ForeignKey("planet.id"))
+    user = db.relationship("User")
+    character = db.relationship("Character")
+    planet = db.relationship("Planet")
+    revision = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # the change feed always reads favorites of a single user
+    __table_args__ = (db.Index('ix_favorite_user_id_revision', 'user_id', 'revision'),)
 
     def __repr__(self):
         return '<Favorite %r>' % self.id
@@ -49,10 +66,28 @@ class Character(db.Model):
     birth_year = db.Column(db.String(120), nullable=True)
     height = db.Column(db.String(3), nullable=True)
     skin_color = db.Column(db.String(120), nullable=True)
+    # parsed copies of the string stats, so they can be filtered and sorted in SQL
+    height_num = db.Column(db.Float, nullable=True, index=True)
+    revision = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # lets the admin favorite form look characters up by name prefix
+    __table_args__ = (db.Index('ix_character_name_pattern', 'name',
+                               postgresql_ops={'name': 'varchar_pattern_ops'}),)
+
+    # query parameter name -> indexed numeric column
+    NUMERIC_FIELDS = {
+        "height": "height_num",
+    }
 
     def __repr__(self):
         return '<Character %r>' % self.id
 
+    @validates('height')
+    def validate_height(self, key, value):
+        self.height_num = parse_number(value)
+        return value
+
     def serialize(self):
         return {
             "id": self.id,
@@ -76,9 +111,40 @@ class Planet(db.Model):
     rotation_period = db.Column(db.String(120), nullable=True)
     diameter = db.Column(db.String(3), nullable=True)
     terrain = db.Column(db.String(120), nullable=True)
+    # parsed copies of the string stats, so they can be filtered and sorted in SQL
+    population_num = db.Column(db.BigInteger, nullable=True, index=True)
+    orbital_period_num = db.Column(db.Float, nullable=True, index=True)
+    rotation_period_num = db.Column(db.Float, nullable=True, index=True)
+    diameter_num = db.Column(db.Float, nullable=True, index=True)
+    revision = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # lets the admin prefix search (LIKE 'x%') use an index on Postgres
+    __table_args__ = (db.Index('ix_planet_name_pattern', 'name',
+                               postgresql_ops={'name': 'varchar_pattern_ops'}),)
+
+    # query parameter name -> indexed numeric column
+    NUMERIC_FIELDS = {
+        "population": "population_num",
+        "orbital_period": "orbital_period_num",
+        "rotation_period": "rotation_period_num",
+        "diameter": "diameter_num",
+    }
+
     def __repr__(self):
         return '<Planet %r>' % self.id
 
+    @validates('population')
+    def validate_population(self, key, value):
+        number = parse_number(value)
+        self.population_num = int(number) if number is not None else None
+        return value
+
+    @validates('orbital_period', 'rotation_period', 'diameter')
+    def validate_stat(self, key, value):
+        setattr(self, key + "_num", parse_number(value))
+        return value
+
     def serialize(self):
         return {
             "id": self.id,
@@ -90,4 +156,135 @@ class Planet(db.Model):
             "rotation_period": self.rotation_period,
             "diameter": self.diameter,
             "terrain": self.terrain,
-        }
\ No newline at end of file
+        }
+
+class Tombstone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    # only set for favorites, so a user never sees someone else's deletes
+    user_id = db.Column(db.Integer, nullable=True)
+    revision = db.Column(db.BigInteger, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # snapshot mode looks up the last delete of one entity type
+    __table_args__ = (db.Index('ix_tombstone_entity_revision', 'entity', 'revision'),)
+
+    def __repr__(self):
+        return '<Tombstone %r %r>' % (self.entity, self.entity_id)
+
+    def serialize(self):
+        return {
+            "entity": self.entity,
+            "op": "delete",
+            "id": self.entity_id,
+            "revision": self.revision,
+        }
+
+class ChangeCounter(db.Model):
+    # single row holding the last revision handed out to the change feed
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<ChangeCounter %r>' % self.value
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    user_email = db.Column(db.String(120), nullable=True)
+    params = db.Column(db.JSON, nullable=True)
+    # where to resume from, written by the handler after every chunk
+    cursor = db.Column(db.JSON, nullable=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(120), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # workers poll for the oldest queued jobs
+    __table_args__ = (db.Index('ix_job_status_id', 'status', 'id'),)
+
+    def __repr__(self):
+        return '<Job %r %r>' % (self.id, self.kind)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "progress": self.progress,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class JobLock(db.Model):
+    # one row per job kind, locked while a worker checks the kind's concurrency limit
+    kind = db.Column(db.String(50), primary_key=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return '<JobLock %r>' % self.kind
+
+class JobData(db.Model):
+    # JSON lines payload of a job in numbered chunks: the rows uploaded for an
+    # import or written by an export. Kept in the database because the web and
+    # worker processes do not share a disk.
+    job_id = db.Column(db.Integer, db.ForeignKey("job.id"), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    row_count = db.Column(db.Integer, nullable=False)
+    lines = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return '<JobData %r %r>' % (self.job_id, self.seq)
+
+# Models whose changes are published on GET /changes, keyed by feed name
+TRACKED_MODELS = {
+    "character": Character,
+    "planet": Planet,
+    "favorite": Favorite,
+}
+
+def _reserve_revisions(session, count):
+    # Bumping the counter row locks it until commit, so revisions are handed
+    # out in commit order and a cursor never skips a slower transaction.
+    result = session.execute(
+        db.update(ChangeCounter).where(ChangeCounter.id == 1)
+        .values(value=ChangeCounter.value + count)
+    )
+    if result.rowcount == 0:
+        session.execute(db.insert(ChangeCounter).values(id=1, value=count))
+    last = session.execute(db.select(ChangeCounter.value).where(ChangeCounter.id == 1)).scalar_one()
+    return last - count + 1
+
+@event.listens_for(Session, "before_flush")
+def stamp_revisions(session, flush_context, instances):
+    tracked = tuple(TRACKED_MODELS.values())
+    changed = [x for x in session.new if isinstance(x, tracked)]
+    changed += [x for x in session.dirty if isinstance(x, tracked) and session.is_modified(x)]
+    deleted = [x for x in session.deleted if isinstance(x, tracked)]
+    if not changed and not deleted:
+        return
+
+    revision = _reserve_revisions(session, len(changed) + len(deleted))
+    for obj in changed:
+        obj.revision = revision
+        revision += 1
+    for obj in deleted:
+        session.add(Tombstone(
+            entity=obj.__tablename__,
+            entity_id=obj.id,
+            user_id=obj.user_id if isinstance(obj, Favorite) else None,
+            revision=revision,
+        ))
+        revision += 1
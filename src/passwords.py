@@ -0,0 +1,105 @@
+"""
+Password hashing for /token and /create-user. The key derivation function is
+slow on purpose, so it runs in a small bounded thread pool (hashlib releases
+the GIL while hashing) and a login storm can only use KDF_WORKERS cores.
+When too many hashes are already waiting, new logins are turned away
+immediately instead of queueing up behind them.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+from utils import APIException
+
+# Full werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Stored hashes made with another method are re-hashed on the next login.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+KDF_WORKERS = int(os.environ.get("KDF_WORKERS", 2))
+KDF_MAX_PENDING = int(os.environ.get("KDF_MAX_PENDING", KDF_WORKERS * 4))
+KDF_TIMEOUT = float(os.environ.get("KDF_TIMEOUT", 5))
+LOGIN_CACHE_SECONDS = int(os.environ.get("LOGIN_CACHE_SECONDS", 300))
+LOGIN_CACHE_SIZE = int(os.environ.get("LOGIN_CACHE_SIZE", 10000))
+
+_pool = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+_pending = threading.BoundedSemaphore(KDF_MAX_PENDING)
+
+# verified (email, password) digests -> expiry, oldest first
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
+
+# checked for unknown emails, so they cost as much as a wrong password
+_DUMMY_HASH = generate_password_hash("dummy password", method=PASSWORD_HASH_METHOD)
+
+def _run_kdf(fn, *args):
+    if not _pending.acquire(blocking=False):
+        raise APIException("Too many login attempts, try again later", status_code=503)
+    try:
+        future = _pool.submit(fn, *args)
+    except Exception:
+        _pending.release()
+        raise
+    # the slot is freed when the hash is really done, not when we stop waiting,
+    # so abandoned hashes still count against KDF_MAX_PENDING
+    future.add_done_callback(lambda f: _pending.release())
+    try:
+        return future.result(timeout=KDF_TIMEOUT)
+    except FutureTimeoutError:
+        raise APIException("Login is taking too long, try again later", status_code=503)
+
+def hash_password(password):
+    return _run_kdf(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def needs_rehash(password_hash):
+    return password_hash.split("$", 1)[0] != PASSWORD_HASH_METHOD
+
+def _cache_key(email, password_hash, password):
+    # keyed with the stored salted hash, so a changed password misses the cache
+    return hmac.new(password_hash.encode(), f"{email}\0{password}".encode(), hashlib.sha256).digest()
+
+def _cached(key):
+    now = time.monotonic()
+    with _verified_lock:
+        expires = _verified.get(key)
+        if expires is None:
+            return False
+        if expires < now:
+            del _verified[key]
+            return False
+        return True
+
+def _remember(key):
+    with _verified_lock:
+        _verified[key] = time.monotonic() + LOGIN_CACHE_SECONDS
+        _verified.move_to_end(key)
+        while len(_verified) > LOGIN_CACHE_SIZE:
+            _verified.popitem(last=False)
+
+def verify_password(user, password):
+    """
+    Check the password of user (None for an unknown email). A correct password
+    hashed with an outdated method is re-hashed if the pool has room for it,
+    the caller has to commit.
+    """
+    if user is None or not password:
+        _run_kdf(check_password_hash, _DUMMY_HASH, password or "")
+        return False
+
+    key = _cache_key(user.email, user.password, password)
+    if not _cached(key):
+        if not _run_kdf(check_password_hash, user.password, password):
+            return False
+        _remember(key)
+
+    if needs_rehash(user.password):
+        # best effort: when the pool is busy keep the old hash, a later login
+        # retries (from the cache, so it costs one hash instead of two)
+        try:
+            user.password = hash_password(password)
+            _remember(_cache_key(user.email, user.password, password))
+        except APIException:
+            pass
+    return True
@@ -0,0 +1,119 @@
+"""
+Optional snapshot mode for the reference data (characters and planets).
+With SNAPSHOT_MODE=1 every worker keeps an immutable in-memory copy of both
+tables, already serialized to JSON bytes per entity and per collection, plus
+id and name indexes, and serves the read endpoints from it without SQL.
+A background thread polls the highest revision of both tables (see the change
+feed) and builds a new snapshot when it moves, then swaps it in atomically.
+Until the first snapshot is ready, requests are answered from the database.
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+from flask import request, current_app
+from models import db, Character, Planet, Tombstone
+
+SNAPSHOT_MODE = os.environ.get("SNAPSHOT_MODE") in ("1", "true")
+POLL_SECONDS = float(os.environ.get("SNAPSHOT_POLL_SECONDS", 5))
+
+SNAPSHOT_MODELS = {
+    "character": Character,
+    "planet": Planet,
+}
+
+# entities: id -> JSON bytes, names: name -> tuple of ids, collection: JSON bytes of the listing
+SnapshotTable = namedtuple("SnapshotTable", ["entities", "names", "collection"])
+Snapshot = namedtuple("Snapshot", ["version", "tables"])
+
+# replaced as a whole, never modified, so readers need no lock
+current = None
+# bumped by request_refresh, a build started before the bump is thrown away
+_generation = 0
+_wake = threading.Event()
+
+def dumps(value):
+    # same separators and key order as jsonify outside debug mode
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+
+def current_version():
+    # every write to these tables bumps a revision, the maxes come from their indexes
+    return (
+        db.session.query(db.func.max(Character.revision)).scalar(),
+        db.session.query(db.func.max(Planet.revision)).scalar(),
+        db.session.query(db.func.max(Tombstone.revision)).filter(
+            Tombstone.entity.in_(SNAPSHOT_MODELS)).scalar(),
+    )
+
+def build_snapshot():
+    # the version is read first, a write racing the build only causes another rebuild
+    version = current_version()
+    tables = {}
+    for name, model in SNAPSHOT_MODELS.items():
+        entities = {}
+        names = {}
+        for row in model.query.order_by(model.id):
+            entities[row.id] = dumps(row.serialize())
+            names.setdefault(row.name, []).append(row.id)
+        tables[name] = SnapshotTable(
+            entities=entities,
+            names={k: tuple(v) for k, v in names.items()},
+            collection=b"[" + b",".join(entities.values()) + b"]",
+        )
+    return Snapshot(version=version, tables=tables)
+
+def refresh(app):
+    global current
+    generation = _generation
+    with app.app_context():
+        try:
+            if current is None or current_version() != current.version:
+                snapshot = build_snapshot()
+                if generation == _generation:
+                    current = snapshot
+        except Exception as e:
+            # e.g. tables missing before `flask db upgrade`, retried on the next poll
+            app.logger.warning("Snapshot refresh failed: %s", e)
+        finally:
+            db.session.remove()
+
+def request_refresh():
+    # This worker just wrote reference data: serve its reads from the database
+    # until a snapshot containing the write is swapped in.
+    global current, _generation
+    _generation += 1
+    current = None
+    _wake.set()
+
+def _poll(app):
+    while True:
+        refresh(app)
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+
+def snapshot_response(table, entity_id=None):
+    """
+    Response for a characters/planets read served from the snapshot, or None
+    when it has to go to the database: snapshot mode is off or not ready yet,
+    or the request uses filters, sorting or with_favorites.
+    """
+    snapshot = current
+    if snapshot is None or set(request.args) - {"name"}:
+        return None
+
+    data = snapshot.tables[table]
+    if entity_id is not None:
+        entity = data.entities.get(entity_id)
+        body = b"[]" if entity is None else b"[" + entity + b"]"
+    elif "name" in request.args:
+        ids = data.names.get(request.args["name"], ())
+        body = b"[" + b",".join(data.entities[x] for x in ids) + b"]"
+    else:
+        body = data.collection
+    # jsonify ends every body with a newline
+    return current_app.response_class(body + b"\n", status=200, mimetype="application/json")
+
+def setup_snapshot(app):
+    if not SNAPSHOT_MODE:
+        return
+    threading.Thread(target=_poll, args=(app,), name="snapshot-refresh", daemon=True).start()
@@ -1,5 +1,8 @@
+import math
 from flask import jsonify, url_for
 
+BIGINT_LIMIT = 2 ** 63
+
 class APIException(Exception):
     status_code = 400
 
@@ -15,6 +18,19 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def parse_number(value):
+    # SWAPI style stats are strings like "1,000,000", "unknown" or "n/a"
+    if value is None:
+        return None
+    try:
+        number = float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+    # "nan", "inf" and anything a BigInteger column cannot hold are not stats
+    if not math.isfinite(number) or abs(number) >= BIGINT_LIMIT:
+        return None
+    return number
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()